@@ -1,36 +1,236 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
+from collections import Counter
 from autogen import ConversableAgent
+import asyncio
+import contextlib
+import dbm
+import json
 import re
+import shelve
 import string
+import tempfile
 import sys
 import os
 import math
+import pickle
+import time
+import httpx
+import numpy as np
+import orjson
 from dotenv import load_dotenv
 
 # Load the .env file
 load_dotenv()
 
+# final chat summaries keyed by sanitized restaurant name, so repeated queries skip the review analysis and summary chats
+SCORE_CACHE_PATH = os.environ.get("RESTAURANT_SCORE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "restaurant_scores.db"))
+SCORE_CACHE_TTL = float(os.environ.get("RESTAURANT_SCORE_CACHE_TTL", 24 * 60 * 60))
+
+
+class _SharedHttpClient(httpx.Client):
+    ''' Every agent deep-copies its llm_config; returning self keeps all agents on this one connection pool. '''
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+# one keep-alive connection pool to OpenAI for every agent, stage and query
+_HTTP_CLIENT = _SharedHttpClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+
+
+def _llm_config() -> Dict:
+    ''' Builds the agents' llm_config, reading OPENAI_API_KEY at call time so it may be set after importing this module. '''
+    return {"config_list": [{"model": "gpt-4o-mini", "api_key": os.environ.get("OPENAI_API_KEY"), "http_client": _HTTP_CLIENT}]}
+
+
+VALID_CODE_CHARS = frozenset(string.ascii_lowercase + string.digits)
+# runs of non-alphanumeric characters, used to split a query into words
+WORD_SEPARATORS = re.compile(r'[\W_]+')
+
+
+class _SanitizeTable(dict):
+    ''' Translation table for str.translate that lowercases valid code characters and drops everything else.
+    ASCII is filled in up front and any other codepoint is memoized on first sight, so sanitize() is a single C-level translate. '''
+
+    def __init__(self):
+        super().__init__()
+        for codepoint in range(128):
+            self.__missing__(codepoint)
+
+    def __missing__(self, codepoint):
+        # lowercase first so characters such as the Kelvin sign still fold to their ASCII letter
+        self[codepoint] = ''.join(c for c in chr(codepoint).lower() if c in VALID_CODE_CHARS) or None
+        return self[codepoint]
+
+
+_SANITIZE_TABLE = _SanitizeTable()
+
+# constant part of the overall score normalization: 10 / sqrt(125)
+_SCORE_SCALE = 10.0 / math.sqrt(125.0)
+# scores are integers from 1-5, so their square roots are looked up instead of computed
+_SQRT_SCORES = np.sqrt(np.arange(6, dtype=np.float64))
+
+DATA_PATH = 'restaurant-data.txt'
+INDEX_PATH = 'restaurant-data.idx.pkl'
+# bump when the pickled index layout changes so stale pickles are rebuilt
+_INDEX_VERSION = 5
+# what loading a corrupt or foreign pickle (index file or score cache entry) can raise
+_PICKLE_LOAD_ERRORS = (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError, TypeError, IndexError)
+
+# sanitized restaurant name -> (canonical restaurant name, list of reviews), built on first use
+_INDEX: Dict[str, Tuple[str, List[str]]] = None
+
+# how often the pipeline found the restaurant without the data fetch agent ("hit") or not ("miss")
+LOCAL_NAME_MATCHES = Counter()
+
 
 def sanitize(name):
-    SPACES = re.compile(r'\s+')
-    VALID_CODE_CHARS = set(string.ascii_lowercase + string.digits)
-    return ''.join(c for c in SPACES.sub('', name).strip().lower() if c in VALID_CODE_CHARS).strip()
+    return name.translate(_SANITIZE_TABLE)
+
+
+def _parse_index(path: str) -> Dict[str, Tuple[str, List[str]]]:
+    ''' Groups the reviews in the data file by sanitized restaurant name.
+    This only runs when the pickled index is missing or stale, so the whole file is simply read and split in one go. '''
+    index = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        lines = file.read().splitlines()
+    for line in lines:
+        restaurant, sep, review = line.partition('.')
+        if not sep:
+            continue
+        restaurant = restaurant.strip()
+        key = sanitize(restaurant)
+        # a nameless line, or a name with no valid code characters, would be stored under '' and match every query
+        if not restaurant or not key:
+            continue
+        index.setdefault(key, (restaurant, []))[1].append(review.strip())
+    return index
+
+
+def _load_index() -> Dict[str, Tuple[str, List[str]]]:
+    ''' Loads the reviews grouped by sanitized restaurant name, once per process.
+    The parsed index is pickled next to the data file together with the data file's mtime and size,
+    and reused for as long as both still match exactly. '''
+    global _INDEX
+    if _INDEX is None:
+        data_stat = os.stat(DATA_PATH)
+        data_stamp = (data_stat.st_mtime_ns, data_stat.st_size)
+        index = None
+        try:
+            with open(INDEX_PATH, 'rb') as file:
+                loaded = pickle.load(file)
+            # anything but our own (version, data stamp, dict) triple is a foreign or stale pickle and gets rebuilt
+            if (isinstance(loaded, tuple) and len(loaded) == 3 and loaded[0] == _INDEX_VERSION
+                    and loaded[1] == data_stamp and isinstance(loaded[2], dict)):
+                index = loaded[2]
+        except _PICKLE_LOAD_ERRORS:
+            index = None
+        if index is None:
+            index = _parse_index(DATA_PATH)
+            _write_index(index, data_stamp)
+        _INDEX = index
+    return _INDEX
+
+
+def _write_index(index: Dict[str, Tuple[str, List[str]]], data_stamp: Tuple[int, int]):
+    ''' Atomically replaces the index pickle; each writer uses its own temp file so concurrent processes never share one. '''
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(os.path.abspath(INDEX_PATH)),
+                                         prefix=os.path.basename(INDEX_PATH) + '.', suffix='.tmp', delete=False) as file:
+            tmp_path = file.name
+            pickle.dump((_INDEX_VERSION, data_stamp, index), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, INDEX_PATH)
+    except OSError:
+        if tmp_path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
 
 
 def fetch_restaurant_data(restaurant_name: str) -> Dict[str, List[str]]:
     ''' This function takes in a restaurant name and returns the reviews for that restaurant. 
     The output should be a dictionary with the key being the restaurant name and the value being a list of reviews for that restaurant. '''
 
-    sanitized_name = sanitize(restaurant_name)
-    restaurant_data = {restaurant_name: []}
-    with open('restaurant-data.txt', 'r') as file:
-        for line in file:
-            restaurant, review = line.split('.', 1)
-            restaurant = restaurant.strip()
-            review = review.strip()
-            if sanitize(restaurant) == sanitized_name:
-                restaurant_data[restaurant_name].append(review)
-    return restaurant_data
+    name, reviews = _load_index().get(sanitize(restaurant_name), (restaurant_name, []))
+    return {name: list(reviews)}
+
+
+def extract_name_local(user_query: str) -> str:
+    ''' Returns the name of the known restaurant mentioned in the query, or None if it names none.
+    A restaurant only matches whole consecutive words of the query (so "I hope" is not "IHOP"); the longest match wins. '''
+    index = _load_index()
+    longest_key = max(map(len, index), default=0)
+    words = [word for word in (sanitize(word) for word in WORD_SEPARATORS.split(user_query)) if word]
+    match = ''
+    for start in range(len(words)):
+        candidate = ''
+        for word in words[start:]:
+            candidate += word
+            if len(candidate) > longest_key:
+                break
+            # '' is never a restaurant, even if an index holds it
+            if candidate and candidate in index and len(candidate) > len(match):
+                match = candidate
+    return index[match][0] if match else None
+
+
+def _requested_restaurant_name(fetch_result) -> str:
+    ''' Returns the restaurant name the data fetch agent asked fetch_restaurant_data for, falling back to its plain text reply. '''
+    for message in fetch_result.chat_history:
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call.get("function", {})
+            if function.get("name") != "fetch_restaurant_data":
+                continue
+            try:
+                return json.loads(function.get("arguments") or "{}")["restaurant_name"]
+            except (ValueError, KeyError, TypeError):
+                continue
+    return (fetch_result.summary or "").strip()
+
+
+def _get_cached_summary(restaurant_key: str) -> str:
+    ''' Returns the cached final summary for a sanitized restaurant name, or None if it is missing, older than SCORE_CACHE_TTL,
+    computed from a different version of the data file, or the cache cannot be read (e.g. locked by another process). '''
+    try:
+        with shelve.open(SCORE_CACHE_PATH, flag='r') as cache:
+            entry = cache.get(restaurant_key)
+        data_mtime = os.stat(DATA_PATH).st_mtime_ns
+        if not isinstance(entry, tuple) or len(entry) != 3:
+            return None
+        timestamp, entry_data_mtime, summary = entry
+        if entry_data_mtime != data_mtime or time.time() - timestamp > SCORE_CACHE_TTL:
+            return None
+    except (*dbm.error, *_PICKLE_LOAD_ERRORS):
+        return None
+    return summary
+
+
+def _cache_summary(restaurant_key: str, summary: str):
+    ''' Stores a final summary along with the data file's mtime; failures only mean the next run is uncached. '''
+    try:
+        os.makedirs(os.path.dirname(SCORE_CACHE_PATH), exist_ok=True)
+        data_mtime = os.stat(DATA_PATH).st_mtime_ns
+        with shelve.open(SCORE_CACHE_PATH) as cache:
+            cache[restaurant_key] = (time.time(), data_mtime, summary)
+    except dbm.error:
+        pass
+
+
+def _parse_review_scores(content: str) -> Tuple[List[int], List[int]]:
+    ''' Parses the review analysis agent's JSON reply into its food scores and customer service scores.
+    Both lists must be non-empty lists of integer scores from 1-5. A miscount of the reviews is tolerated:
+    calculate_overall_score scores over the shorter list, as it always has. '''
+    try:
+        scores = orjson.loads(content)
+        food_scores = scores["food_scores"]
+        customer_service_scores = scores["customer_service_scores"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Review analysis agent returned malformed scores: {content!r}") from e
+    for score_list in (food_scores, customer_service_scores):
+        if (not isinstance(score_list, list) or not score_list
+                or not all(type(score) is int and 1 <= score <= 5 for score in score_list)):
+            raise ValueError(f"Review analysis agent returned malformed scores: {content!r}")
+    return food_scores, customer_service_scores
 
 
 def calculate_overall_score(restaurant_name: str, food_scores: List[int], customer_service_scores: List[int]) -> Dict[str, float]:
@@ -39,13 +239,18 @@ def calculate_overall_score(restaurant_name: str, food_scores: List[int], custom
      SUM(sqrt(food_scores[i]**2 * customer_service_scores[i]) * 1/(N * sqrt(125)) * 10
      The above formula is a geometric mean of the scores, which penalizes food quality more than customer service. '''
 
-    len_food_scores = len(food_scores)
-    len_customer_service_scores = len(customer_service_scores)
-    N = min(len_food_scores, len_customer_service_scores)
-    overall_score = 0
-    for i in range(N):
-        overall_score += ((math.sqrt((food_scores[i] ** 2) * (customer_service_scores[i])) * (1/(N * math.sqrt(125)))) * 10)
-    overall_score = round(overall_score, 2)
+    N = min(len(food_scores), len(customer_service_scores))
+    if N == 0:
+        return {restaurant_name: 0.0}
+    food = np.asarray(food_scores[:N], dtype=np.float64)
+    customer_service = np.asarray(customer_service_scores[:N])
+    # sqrt(food**2 * customer_service) == food * sqrt(customer_service) since scores are nonnegative
+    if customer_service.dtype.kind in 'iu' and customer_service.min() >= 0 and customer_service.max() < len(_SQRT_SCORES):
+        sqrt_customer_service = _SQRT_SCORES[customer_service]
+    else:
+        sqrt_customer_service = np.sqrt(customer_service.astype(np.float64))
+    overall_score = (food * sqrt_customer_service).sum() * (_SCORE_SCALE / N)
+    overall_score = round(float(overall_score), 2)
     return {restaurant_name: overall_score}
 
 
@@ -61,11 +266,9 @@ def get_entrypoint_agent_prompt() -> str:
 
 def get_data_fetch_agent_prompt() -> str:
     return '''
-        You are a helpful agent who can do any of the two things (only one at a time):
-        1. If and only if I give you a query asking for a restaurant review, just extract and return the resturant name from that query;
-        do nothing else except returning the name.
-        2. However, if I give you a list of reviews from a restaurant return those review to me as is without doing any scoring or analysis;
-        I will just need the reviews list back as is.
+        You are a helpful agent who finds which restaurant a query asks about.
+        When I give you a query about a restaurant, call fetch_restaurant_data with the restaurant name from that query.
+        If you cannot call it, reply with only the restaurant name.
         Do no make any other comments or analysis.
     '''
 
@@ -81,41 +284,27 @@ def get_review_analysis_agent_prompt() -> str:
         Score 5/5 has one of these adjectives: awesome, incredible, or amazing.
         Each review will have exactly only two of these keywords, one for describing food and and one for customer service, and the score (out of 5) is 
         only determined through the above listed keywords. No other factors go into score extraction.
+        Reply with only a JSON object with two keys, "food_scores" and "customer_service_scores", each a list of integers
+        holding one score per review in the order the reviews were given, for example:
+        {"food_scores": [3, 4], "customer_service_scores": [2, 5]}
         Apart from what I wrote above, do no make any other comments or analysis.
     '''
 
 
-def get_scoring_agent_prompt() -> str:
-    return '''
-        You are a helpful agent. You will be given some reviews (each review on a new line) with food_scores and customer_service_scores.
-        Every line of review will have the following format:
-
-        <review number>. food_score: <food_score>, customer_service_score: <customer_service_score>
-
-        All scores will be out of 5 and your job is to create two lists of integers:
-        1. A list of all food scores (integers)
-        2. A list of all customer service scores (integers)
-        Do no make any other comments or analysis.
-    '''
-
-
-# Do not modify the signature of the "main" function.
-def main(user_query: str):
+def _build_agents() -> Tuple[ConversableAgent, ConversableAgent, ConversableAgent]:
+    llm_config = _llm_config()
     # the main entrypoint/supervisor agent
     entrypoint_agent = ConversableAgent(
         "entrypoint_agent", 
         system_message=get_entrypoint_agent_prompt(), 
-        llm_config={"config_list": [{"model": "gpt-4o-mini", "api_key": os.environ.get("OPENAI_API_KEY")}]},
+        llm_config=llm_config,
         human_input_mode="NEVER",
     )
-    entrypoint_agent.register_for_execution(name="fetch_restaurant_data")(fetch_restaurant_data)
-    entrypoint_agent.register_for_execution(name="calculate_overall_score")(calculate_overall_score)
-
 
     data_fetch_agent = ConversableAgent(
         "data_fetch_agent", 
         system_message=get_data_fetch_agent_prompt(), 
-        llm_config={"config_list": [{"model": "gpt-4o-mini", "api_key": os.environ.get("OPENAI_API_KEY")}]},
+        llm_config=llm_config,
         human_input_mode="NEVER",
     )
     data_fetch_agent.register_for_llm(name="fetch_restaurant_data", description="Fetches the reviews for a specific restaurant.")(fetch_restaurant_data)
@@ -123,49 +312,125 @@ def main(user_query: str):
     review_analysis_agent = ConversableAgent(
         "review_analysis_agent", 
         system_message=get_review_analysis_agent_prompt(),
-        llm_config={"config_list": [{"model": "gpt-4o-mini", "api_key": os.environ.get("OPENAI_API_KEY")}]},
+        llm_config={**llm_config, "response_format": {"type": "json_object"}},
         human_input_mode="NEVER",
     )
+    return entrypoint_agent, data_fetch_agent, review_analysis_agent
 
-    scoring_agent = ConversableAgent(
-        "scoring_agent", 
-        system_message=get_scoring_agent_prompt(),
-        llm_config={"config_list": [{"model": "gpt-4o-mini", "api_key": os.environ.get("OPENAI_API_KEY")}]},
-        human_input_mode="NEVER",
+
+# idle (api key, (entrypoint, data fetch, review analysis)) agent sets; each running query holds a set of its own
+_AGENT_POOL: List[Tuple[str, Tuple[ConversableAgent, ConversableAgent, ConversableAgent]]] = []
+
+
+@contextlib.contextmanager
+def _pooled_agents():
+    ''' Lends out a set of agents, building one only when every pooled set is in use, and resets it on return.
+    Sets built with a different OPENAI_API_KEY than the current one are dropped rather than reused. '''
+    api_key = os.environ.get("OPENAI_API_KEY")
+    _AGENT_POOL[:] = [(pooled_key, agents) for pooled_key, agents in _AGENT_POOL if pooled_key == api_key]
+    agents = _AGENT_POOL.pop()[1] if _AGENT_POOL else _build_agents()
+    try:
+        yield agents
+    finally:
+        for agent in agents:
+            agent.reset()
+        _AGENT_POOL.append((api_key, agents))
+
+
+async def amain(user_query: str) -> str:
+    ''' Runs the restaurant review pipeline for one query on the event loop and returns the final chat summary. '''
+    with _pooled_agents() as agents:
+        return await _run_pipeline(user_query, *agents)
+
+
+async def _run_pipeline(user_query: str, entrypoint_agent: ConversableAgent, data_fetch_agent: ConversableAgent,
+                        review_analysis_agent: ConversableAgent) -> str:
+    # A query that already names a known restaurant does not need the LLM to extract it.
+    restaurant_name = extract_name_local(user_query)
+    LOCAL_NAME_MATCHES["hit" if restaurant_name is not None else "miss"] += 1
+    if restaurant_name is None:
+        # One turn is enough: the name is read off the suggested tool call and the reviews are fetched here,
+        # rather than paying for a second turn in which the agent echoes every review back.
+        fetch_result = await entrypoint_agent.a_initiate_chat(
+            data_fetch_agent,
+            message=f'''Find the restaurant this query asks about and fetch its reviews. Query: {user_query}''',
+            max_turns=1,
+            clear_history=True,
+            summary_method="last_msg",
+        )
+        requested_name = _requested_restaurant_name(fetch_result)
+        # the reply may wrap the name in a sentence ("The restaurant is Taco Bell."), so match it locally too
+        restaurant_name = extract_name_local(requested_name) or requested_name
+    restaurant_data = fetch_restaurant_data(restaurant_name)
+    restaurant_name = next(iter(restaurant_data))
+    if not restaurant_data[restaurant_name]:
+        summary = f"No reviews found for {restaurant_name or 'this restaurant'}."
+        print("Chat Summary: ", summary)
+        return summary
+    restaurant_key = sanitize(restaurant_name)
+    # Same JSON text the fetch_restaurant_data tool call would return.
+    reviews_summary = json.dumps(restaurant_data)
+
+    summary = _get_cached_summary(restaurant_key)
+    if summary is not None:
+        print("Chat Summary: ", summary)
+        return summary
+
+    analysis_result = await entrypoint_agent.a_initiate_chat(
+        review_analysis_agent,
+        message='These are the reviews for the restaurant',
+        carryover=reviews_summary,
+        max_turns=1,
+        summary_method="last_msg",
     )
-    scoring_agent.register_for_llm(name="calculate_overall_score", description='''
-        Calculates the overall score for a resturant when given a restaurant name, a list of food scores and a list of customer service scores.
-    ''')(calculate_overall_score)
-
-    result = entrypoint_agent.initiate_chats([
-        {
-            "recipient": data_fetch_agent,
-            "message": f'''{user_query}. Once you have fetched all the reviews of the restaurant, end the chat.''',
-            "max_turns": 2,
-            "clear_history": True,
-            "summary_method": "last_msg",
-        },
-        {
-            "recipient": review_analysis_agent,
-            "message": 'These are the reviews for the restaurant',
-            "max_turns": 1,
-            "summary_method": "last_msg",
-        },
-        {
-            "recipient": scoring_agent,
-            "message": 'These are the reviews for the restaurant. Once you get the overall score number just return that and end the chat.',
-            "max_turns": 4,
-            "max_consecutive_auto_reply": 1,
-            "summary_method": "last_msg",
-        },
-        {
-            "recipient": entrypoint_agent,
-            "message": 'What is the overall score of the restaurant. Answer only from the overall score number passed in the context.',
-            "max_turns": 1,
-            "summary_method": "last_msg",
-        },
-    ])
-    print("Chat Summary: ", result[-1].summary)
+    # The review analysis agent returns both score lists as JSON, so the overall score needs no scoring agent.
+    food_scores, customer_service_scores = _parse_review_scores(analysis_result.summary)
+    overall_score = calculate_overall_score(restaurant_name, food_scores, customer_service_scores)
+
+    result = await entrypoint_agent.a_initiate_chat(
+        entrypoint_agent,
+        message='What is the overall score of the restaurant. Answer only from the overall score number passed in the context.',
+        carryover=json.dumps(overall_score),
+        max_turns=1,
+        summary_method="last_msg",
+    )
+    summary = result.summary
+    if summary:
+        _cache_summary(restaurant_key, summary)
+    print("Chat Summary: ", summary)
+    return summary
+
+
+async def main_batch(queries: List[str]) -> List[str]:
+    ''' Runs the pipeline for several queries concurrently and returns their final chat summaries in query order.
+    At most MAX_CONCURRENT_API_CALLS (default 8) queries are in flight at once to stay within OpenAI rate limits.
+    A query that fails is reported on stderr and gets an "Error: ..." summary, so it does not discard the other results. '''
+    semaphore = asyncio.Semaphore(int(os.environ.get("MAX_CONCURRENT_API_CALLS", "8")))
+
+    async def run_query(query: str) -> str:
+        async with semaphore:
+            try:
+                return await amain(query)
+            except Exception as e:
+                print(f"Query {query!r} failed: {e!r}", file=sys.stderr)
+                return f"Error: {e}"
+
+    return await asyncio.gather(*[run_query(query) for query in queries])
+
+
+# Do not modify the signature of the "main" function.
+def main(user_query: str):
+    asyncio.run(amain(user_query))
+
+
+# Batch mode: python main.py --batch <file with one query per line>
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == "--batch":
+    assert len(sys.argv) > 2, "Please ensure you include a file with one query per line after --batch."
+    with open(sys.argv[2], 'r') as file:
+        queries = [line.strip() for line in file if line.strip()]
+    asyncio.run(main_batch(queries))
+    print("Local restaurant name matches: ", dict(LOCAL_NAME_MATCHES))
+    sys.exit(0)
 
 
 # DO NOT modify this code below.
@@ -0,0 +1,100 @@
+import sys
+import math
+import random
+from main import extract_name_local, calculate_overall_score, _parse_review_scores
+
+class TerminalColors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+
+def report(name: str, passed: bool, expected, got) -> bool:
+    if passed:
+        print(TerminalColors.GREEN + f"{name} Passed." + TerminalColors.RESET, "Expected: ", expected)
+    else:
+        print(TerminalColors.RED + f"{name} Failed." + TerminalColors.RESET, "Expected: ", expected, "Got: ", got)
+    return passed
+
+def baseline_overall_score(food_scores, customer_service_scores) -> float:
+    ''' The original per-element loop, kept here as the reference for calculate_overall_score. '''
+    N = min(len(food_scores), len(customer_service_scores))
+    overall_score = 0
+    for i in range(N):
+        overall_score += ((math.sqrt((food_scores[i] ** 2) * (customer_service_scores[i])) * (1/(N * math.sqrt(125)))) * 10)
+    return round(overall_score, 2)
+
+def local_name_tests() -> list:
+    ''' Deterministic checks of the local restaurant name matcher; no API key needed. '''
+    cases = [
+        ("What is the overall score for taco bell?", "Taco Bell"),
+        ("What is the overall score for In N Out?", "In-n-Out"),
+        ("How good is the restaurant Chick-fil-A overall?", "Chick-fil-A"),
+        ("What is the overall score for Krispy Kreme?", "Krispy Kreme"),
+        ("What would you rate Tim Hortons?", "Tim Horton's"),
+        ("How good is McDonalds as a restaurant", "McDonald's"),
+        ("Is IHOP any good?", "IHOP"),
+        ("How would you rate Wendy's? I hope it is good", None),
+        ("Hi, hope you can score Pizza Hut for me", None),
+        ("", None),
+    ]
+    results = []
+    for i, (query, expected) in enumerate(cases):
+        result = extract_name_local(query)
+        results.append(report(f"Name test {i+1} ({query!r})", result == expected, expected, result))
+    return results
+
+def overall_score_tests() -> list:
+    ''' calculate_overall_score must round exactly like the original loop, including mismatched list lengths. '''
+    cases = [([], []), ([5, 5], []), ([5] * 40, [5] * 40), ([1] * 40, [1] * 40), ([3, 4, 5], [2, 5])]
+    results = []
+    for i, (food_scores, customer_service_scores) in enumerate(cases):
+        expected = baseline_overall_score(food_scores, customer_service_scores)
+        result = calculate_overall_score("x", food_scores, customer_service_scores)["x"]
+        results.append(report(f"Score test {i+1} ({len(food_scores)} vs {len(customer_service_scores)} scores)", result == expected, expected, result))
+
+    rng = random.Random(0)
+    mismatches = []
+    for _ in range(200):
+        n = rng.randint(1, 60)
+        food_scores = [rng.randint(1, 5) for _ in range(n)]
+        customer_service_scores = [rng.randint(1, 5) for _ in range(n + rng.randint(-3, 3))]
+        expected = baseline_overall_score(food_scores, customer_service_scores)
+        result = calculate_overall_score("x", food_scores, customer_service_scores)["x"]
+        if result != expected:
+            mismatches.append((food_scores, customer_service_scores, expected, result))
+    results.append(report("Score test on 200 random score lists", not mismatches, "no mismatches", mismatches[:1]))
+    return results
+
+def review_scores_tests() -> list:
+    ''' _parse_review_scores accepts well-formed replies (even miscounted ones) and rejects malformed payloads. '''
+    accepted = [
+        ('{"food_scores": [3, 4], "customer_service_scores": [2, 5]}', ([3, 4], [2, 5])),
+        ('{"food_scores": [3, 4, 1], "customer_service_scores": [2, 5]}', ([3, 4, 1], [2, 5])),
+    ]
+    rejected = [
+        'not json',
+        '[1, 2]',
+        '{"food_scores": [3, 4]}',
+        '{"food_scores": [], "customer_service_scores": [2]}',
+        '{"food_scores": 3, "customer_service_scores": [2]}',
+        '{"food_scores": [true, 4], "customer_service_scores": [2, 5]}',
+        '{"food_scores": [3, 4], "customer_service_scores": [-2, 5]}',
+        '{"food_scores": [3, 6], "customer_service_scores": [2, 5]}',
+        '{"food_scores": [3, 4.0], "customer_service_scores": [2, 5]}',
+    ]
+    results = []
+    for content, expected in accepted:
+        result = _parse_review_scores(content)
+        results.append(report(f"Parse test {content!r}", result == expected, expected, result))
+    for content in rejected:
+        try:
+            result = _parse_review_scores(content)
+        except ValueError:
+            result = "ValueError"
+        results.append(report(f"Parse test {content!r}", result == "ValueError", "ValueError", result))
+    return results
+
+results = local_name_tests() + overall_score_tests() + review_scores_tests()
+print(f"{sum(results)}/{len(results)} Tests Passed")
+if not all(results):
+    sys.exit(1)